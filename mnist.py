@@ -0,0 +1,982 @@
+"""
+Train an MLP digit classifier on MNIST on top of a micrograd-style autograd
+graph.
+
+Unlike micrograd.engine.Value, the graph nodes here recompute their data in a
+_forward() method instead of in __init__, so the loss graph is built exactly
+once and then re-run for every training image.  Each fully connected layer is
+a single graph node storing its weights in one contiguous float array
+(structure-of-arrays), and forward/backward are dense matvec loops, instead of
+one Value object per scalar weight and per add/multiply.
+
+Expects the four MNIST idx files (train-images-idx3-ubyte etc.) unzipped in
+the current directory, see http://yann.lecun.com/exdb/mnist/
+"""
+import math
+import mmap
+import random
+import struct
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _maybe_njit(func):
+    """ compile a kernel over flat buffers with numba when it is installed,
+    else run it as plain python """
+    if numba is not None:
+        return numba.njit(cache=True, fastmath=True)(func)
+    return func
+
+NUM_DIGITS = 10
+DIM = 28 * 28
+
+NUM_EPOCHS = 10
+BATCH_SIZE = 10
+LEARNING_RATE = 0.1
+
+# multiplying by the reciprocal is quite a bit cheaper than dividing by 255.
+_INV_255 = 1.0 / 255.0
+
+
+OP_LEAF = 0
+OP_ADD = 1
+OP_SUB = 2
+OP_MUL = 3
+OP_POW = 4
+OP_EXP = 5
+OP_LOG = 6
+OP_NEG = 7
+OP_MAX = 8
+OP_ITEM = 9
+OP_OBJECT = 10
+OP_REDUCEMAX = 11
+
+
+class BaseValue:
+    """ a node in a reusable autograd graph """
+    _op = ''
+    _opcode = OP_LEAF
+    __slots__ = ()
+
+    def get_data(self):
+        return self.data
+
+    def _prev(self):
+        return ()
+
+    def _forward(self):
+        pass
+
+    def _backward(self):
+        pass
+
+    def _zero_grad(self):
+        self.grad = 0.0
+
+    def _release(self):
+        """ drop graph-construction-only state once a tape owns the node """
+
+    def topo(self):
+        """ topological order of all the nodes this one depends on """
+        topo = []
+        visited = set()
+        def build_topo(v):
+            if v not in visited:
+                visited.add(v)
+                for child in v._prev():
+                    build_topo(child)
+                topo.append(v)
+        build_topo(self)
+        return topo
+
+    def add(self, other):
+        return AddValue(self, other)
+
+    def sub(self, other):
+        return SubValue(self, other)
+
+    def mul(self, other):
+        return MulValue(self, other)
+
+    def pow(self, exponent):
+        return PowValue(self, exponent)
+
+    def exp(self):
+        return ExpValue(self)
+
+    def log(self):
+        return LogValue(self)
+
+    def max(self, other):
+        return Max(self, other)
+
+    def neg(self):
+        return NegValue(self)
+
+    def __repr__(self):
+        return "%s(data=%s, grad=%s)" % (self.__class__.__name__, self.data, self.grad)
+
+
+class Value(BaseValue):
+    """ a leaf holding a mutable scalar, set from outside the graph """
+    _op = 'leaf'
+    __slots__ = ('data', 'grad', '_tape_idx')
+
+    def __init__(self, data=0.0):
+        self.data = data
+        self.grad = 0.0
+
+
+class UnaryValue(BaseValue):
+    __slots__ = ('data', 'grad', '_prev0', '_tape_idx')
+
+    def __init__(self, prev0):
+        self.data = 0.0
+        self.grad = 0.0
+        self._prev0 = prev0
+
+    def _prev(self):
+        return (self._prev0, )
+
+    def _release(self):
+        self._prev0 = None
+
+
+class BinaryValue(BaseValue):
+    __slots__ = ('data', 'grad', '_prev0', '_prev1', '_tape_idx')
+
+    def __init__(self, prev0, prev1):
+        self.data = 0.0
+        self.grad = 0.0
+        self._prev0 = prev0
+        self._prev1 = prev1
+
+    def _prev(self):
+        return (self._prev0, self._prev1)
+
+    def _release(self):
+        self._prev0 = None
+        self._prev1 = None
+
+
+class AddValue(BinaryValue):
+    _op = '+'
+    __slots__ = ()
+    _opcode = OP_ADD
+
+    def _forward(self):
+        self.data = self._prev0.get_data() + self._prev1.get_data()
+
+    def _backward(self):
+        self._prev0.grad += self.grad
+        self._prev1.grad += self.grad
+
+
+class SubValue(BinaryValue):
+    _op = '-'
+    __slots__ = ()
+    _opcode = OP_SUB
+
+    def _forward(self):
+        self.data = self._prev0.get_data() - self._prev1.get_data()
+
+    def _backward(self):
+        self._prev0.grad += self.grad
+        self._prev1.grad -= self.grad
+
+
+class MulValue(BinaryValue):
+    _op = '*'
+    __slots__ = ()
+    _opcode = OP_MUL
+
+    def _forward(self):
+        self.data = self._prev0.get_data() * self._prev1.get_data()
+
+    def _backward(self):
+        self._prev0.grad += self._prev1.get_data() * self.grad
+        self._prev1.grad += self._prev0.get_data() * self.grad
+
+
+class Max(BinaryValue):
+    _op = 'max'
+    __slots__ = ('_left_bigger', )
+    _opcode = OP_MAX
+
+    def _forward(self):
+        leftdata = self._prev0.get_data()
+        rightdata = self._prev1.get_data()
+        # remember which side won so _backward routes the grad without
+        # comparing (or any float arithmetic) again
+        if leftdata > rightdata:
+            self.data = leftdata
+            self._left_bigger = True
+        else:
+            self.data = rightdata
+            self._left_bigger = False
+
+    def _backward(self):
+        if self._left_bigger:
+            self._prev0.grad += self.grad
+        else:
+            self._prev1.grad += self.grad
+
+
+class ReduceMaxValue(BaseValue):
+    """ maximum over a whole list of scalar nodes as one node, instead of a
+    chain of len-1 Max nodes; backward routes the grad to the argmax only """
+    _op = 'reducemax'
+    _opcode = OP_REDUCEMAX
+    __slots__ = ('data', 'grad', '_inputs', '_argmax', '_tape_idx')
+
+    def __init__(self, inputs):
+        self.data = 0.0
+        self.grad = 0.0
+        self._inputs = inputs
+        self._argmax = 0
+
+    def _prev(self):
+        return tuple(self._inputs)
+
+    def _forward(self):
+        inputs = self._inputs
+        best = 0
+        bestdata = inputs[0].get_data()
+        for i in range(1, len(inputs)):
+            data = inputs[i].get_data()
+            if data > bestdata:
+                bestdata = data
+                best = i
+        self.data = bestdata
+        self._argmax = best
+
+    def _backward(self):
+        self._inputs[self._argmax].grad += self.grad
+
+    def _release(self):
+        self._inputs = None
+
+
+class PowValue(UnaryValue):
+    __slots__ = ('exponent', '_dfdx')
+
+    def __init__(self, prev0, exponent):
+        UnaryValue.__init__(self, prev0)
+        self.exponent = exponent
+
+    _op = '**'
+    _opcode = OP_POW
+
+    def _forward(self):
+        x = self._prev0.get_data()
+        self.data = x ** self.exponent
+        # cache the derivative so _backward is one multiply instead of a
+        # second pow call
+        self._dfdx = self.exponent * x ** (self.exponent - 1)
+
+    def _backward(self):
+        self._prev0.grad += self._dfdx * self.grad
+
+
+class ExpValue(UnaryValue):
+    _op = 'exp'
+    __slots__ = ()
+    _opcode = OP_EXP
+
+    def _forward(self):
+        self.data = math.exp(self._prev0.get_data())
+
+    def _backward(self):
+        # d/dx exp(x) is exp(x), which the forward pass already computed
+        self._prev0.grad += self.data * self.grad
+
+
+class LogValue(UnaryValue):
+    _op = 'log'
+    __slots__ = ('_inv_x', )
+    _opcode = OP_LOG
+
+    def _forward(self):
+        x = self._prev0.get_data()
+        self.data = math.log(x)
+        self._inv_x = 1.0 / x
+
+    def _backward(self):
+        self._prev0.grad += self._inv_x * self.grad
+
+
+class NegValue(UnaryValue):
+    _op = 'neg'
+    __slots__ = ()
+    _opcode = OP_NEG
+
+    def _forward(self):
+        self.data = -self._prev0.get_data()
+
+    def _backward(self):
+        self._prev0.grad -= self.grad
+
+
+class InputVector(BaseValue):
+    """ a leaf holding a whole batch of input vectors in one flat float
+    array, sample b at [b*size : (b+1)*size] """
+    _op = 'input'
+    __slots__ = ('data', 'grad', 'size', 'batch_size', '_grad_zeros', '_obj_idx')
+
+    def __init__(self, size, batch_size=1):
+        self.size = size
+        self.batch_size = batch_size
+        self.data = array('d', [0.0] * (size * batch_size))
+        self.grad = array('d', [0.0] * (size * batch_size))
+        self._grad_zeros = array('d', [0.0] * (size * batch_size))
+
+    def _zero_grad(self):
+        # one bulk copy instead of a Python-level store per element
+        self.grad[:] = self._grad_zeros
+
+
+class DenseLayerValue(BaseValue):
+    """ a whole fully connected layer as one graph node: the weights live in a
+    single contiguous nin*nout float array plus a bias vector, and
+    forward/backward run the whole [batch, nin] x [nin, nout] matmul plus an
+    elementwise relu, instead of nin*nout Value objects per sample.  Because
+    the weights are reused for every sample of the batch, larger batches
+    amortize the weight traffic """
+    _op = 'dense'
+    _opcode = OP_OBJECT
+    __slots__ = ('data', 'grad', '_prev0', 'nin', 'nout', 'batch_size',
+                 'nonlin', 'w', 'b', 'gw', 'gb', '_grad_zeros', '_gw_zeros',
+                 '_gb_zeros',
+                 '_np_w', '_np_b', '_np_gw', '_np_gb', '_np_data', '_np_grad',
+                 '_np_x', '_np_gx', '_obj_idx')
+
+    def __init__(self, prev0, nin, nout, nonlin=True):
+        self._prev0 = prev0
+        self.nin = nin
+        self.nout = nout
+        self.batch_size = prev0.batch_size
+        self.nonlin = nonlin
+        # scale the weights so the pre-activations start out O(1) even for
+        # nin=784 inputs
+        scale = nin ** -0.5
+        self.w = array('d', [random.uniform(-1, 1) * scale for _ in range(nin * nout)])
+        self.b = array('d', [0.0] * nout)
+        self.gw = array('d', [0.0] * (nin * nout))
+        self.gb = array('d', [0.0] * nout)
+        self.data = array('d', [0.0] * (nout * self.batch_size))
+        self.grad = array('d', [0.0] * (nout * self.batch_size))
+        self._grad_zeros = array('d', [0.0] * (nout * self.batch_size))
+        self._gw_zeros = array('d', [0.0] * (nin * nout))
+        self._gb_zeros = array('d', [0.0] * nout)
+        if np is not None:
+            # zero-copy numpy views over the very same buffers, so the
+            # BLAS-backed matmul path below shares its storage with
+            # update_params/zero_grads and the pure-python fallback
+            batch = self.batch_size
+            self._np_w = np.frombuffer(self.w).reshape(nout, nin)
+            self._np_b = np.frombuffer(self.b)
+            self._np_gw = np.frombuffer(self.gw).reshape(nout, nin)
+            self._np_gb = np.frombuffer(self.gb)
+            self._np_data = np.frombuffer(self.data).reshape(batch, nout)
+            self._np_grad = np.frombuffer(self.grad).reshape(batch, nout)
+            self._np_x = np.frombuffer(prev0.data).reshape(batch, nin)
+            self._np_gx = np.frombuffer(prev0.grad).reshape(batch, nin)
+
+    def _prev(self):
+        return (self._prev0, )
+
+    def _zero_grad(self):
+        self.grad[:] = self._grad_zeros
+
+    def _forward(self):
+        if np is not None:
+            out = self._np_data
+            np.dot(self._np_x, self._np_w.T, out=out)
+            out += self._np_b
+            if self.nonlin:
+                np.maximum(out, 0.0, out=out)
+            return
+        x = self._prev0.data
+        w = self.w
+        b = self.b
+        nin = self.nin
+        nonlin = self.nonlin
+        data = self.data
+        xbase = 0
+        obase = 0
+        for _ in range(self.batch_size):
+            for j in range(self.nout):
+                acc = b[j]
+                wbase = j * nin
+                for i in range(nin):
+                    acc += w[wbase + i] * x[xbase + i]
+                if nonlin and acc < 0.0:
+                    acc = 0.0
+                data[obase + j] = acc
+            xbase += nin
+            obase += self.nout
+
+    def _backward(self):
+        if np is not None:
+            g = self._np_grad
+            if self.nonlin:
+                g = g * (self._np_data > 0.0)
+            self._np_gb += g.sum(axis=0)
+            self._np_gw += np.dot(g.T, self._np_x)
+            self._np_gx += np.dot(g, self._np_w)
+            return
+        x = self._prev0.data
+        gx = self._prev0.grad
+        w = self.w
+        gw = self.gw
+        gb = self.gb
+        nin = self.nin
+        nonlin = self.nonlin
+        xbase = 0
+        obase = 0
+        for _ in range(self.batch_size):
+            for j in range(self.nout):
+                if nonlin and self.data[obase + j] <= 0.0:
+                    continue
+                gout = self.grad[obase + j]
+                gb[j] += gout
+                wbase = j * nin
+                for i in range(nin):
+                    gw[wbase + i] += gout * x[xbase + i]
+                    gx[xbase + i] += gout * w[wbase + i]
+            xbase += nin
+            obase += self.nout
+
+    def __repr__(self):
+        return "DenseLayerValue(%s, %s, nonlin=%s)" % (self.nin, self.nout, self.nonlin)
+
+
+class ItemValue(UnaryValue):
+    """ scalar view of one element of a vector-valued node """
+    _op = 'item'
+    _opcode = OP_ITEM
+    __slots__ = ('index', )
+
+    def __init__(self, prev0, index):
+        UnaryValue.__init__(self, prev0)
+        self.index = index
+
+    def _forward(self):
+        self.data = self._prev0.data[self.index]
+
+    def _backward(self):
+        self._prev0.grad[self.index] += self.grad
+
+
+class SoftmaxCELoss(UnaryValue):
+    """ fused softmax + negative log likelihood of an integer target over a
+    vector of logits, as a single graph node: _forward computes logsumexp
+    directly and _backward writes (softmax_i - onehot_i) * grad in one
+    sweep, instead of the ~4*NUM_DIGITS scalar nodes of the unfused graph
+    (and without re-deriving exp/log in the backward pass).  data is the
+    loss summed over the whole batch, with one integer target per sample """
+    _op = 'softmax_ce'
+    _opcode = OP_OBJECT
+    __slots__ = ('targets', '_probs', '_obj_idx')
+
+    def __init__(self, logits):
+        UnaryValue.__init__(self, logits)
+        self.targets = array('i', [0] * logits.batch_size)
+        self._probs = array('d', [0.0] * (logits.nout * logits.batch_size))
+
+    def _forward(self):
+        self.data = _softmax_ce_forward(self._prev0.data, self._probs,
+                                        self.targets, self._prev0.nout)
+
+    def _backward(self):
+        _softmax_ce_backward(self._prev0.grad, self._probs, self.targets,
+                             self._prev0.nout, self.grad)
+
+
+@_maybe_njit
+def _softmax_ce_forward(logits, probs, targets, nout):
+    total_loss = 0.0
+    base = 0
+    for b in range(len(targets)):
+        m = logits[base]
+        for i in range(1, nout):
+            if logits[base + i] > m:
+                m = logits[base + i]
+        total = 0.0
+        for i in range(nout):
+            p = math.exp(logits[base + i] - m)
+            probs[base + i] = p
+            total += p
+        inv_total = 1.0 / total
+        for i in range(nout):
+            probs[base + i] *= inv_total
+        total_loss -= logits[base + targets[b]] - m - math.log(total)
+        base += nout
+    return total_loss
+
+
+@_maybe_njit
+def _softmax_ce_backward(gx, probs, targets, nout, g):
+    base = 0
+    for b in range(len(targets)):
+        target = targets[b]
+        for i in range(nout):
+            gx[base + i] += (probs[base + i] - (1.0 if i == target else 0.0)) * g
+        base += nout
+
+
+@_maybe_njit
+def _load_pixels(inp, pixels, base, inv):
+    for i in range(len(pixels)):
+        inp[base + i] = pixels[i] * inv
+
+
+class Tape:
+    """ the loss graph compiled to a flat instruction tape: one opcode plus
+    operand indices per node, with all scalar data and grads in two flat
+    float arrays.  forward/backward are then two sequential sweeps over these
+    arrays with a switch on a plain int, instead of a virtual
+    _forward/_backward call per node """
+
+    def __init__(self, topo):
+        self.data = array('d')
+        self.grad = array('d')
+        self.ops = array('i')
+        self.out_idx = array('i')
+        self.in0_idx = array('i')
+        self.in1_idx = array('i')
+        self.consts = array('d')
+        # operand slots of the variable-arity ops, referenced by start/count
+        self.varargs = array('i')
+        self.objs = []
+        self._build(topo)
+        self._grad_zeros = array('d', [0.0] * len(self.grad))
+        # backward walks pre-reversed copies of the instruction arrays, so
+        # the sweep is a plain forward iteration over contiguous memory
+        # instead of a backwards-stepping index loop
+        self.back_ops = self.ops[::-1]
+        self.back_out_idx = self.out_idx[::-1]
+        self.back_in0_idx = self.in0_idx[::-1]
+        self.back_in1_idx = self.in1_idx[::-1]
+        self.back_consts = self.consts[::-1]
+
+    def _build(self, topo):
+        # give every scalar node a slot in data/grad and every vector node an
+        # entry in objs; the nodes keep their index and act as handles
+        for node in topo:
+            if isinstance(node, (InputVector, DenseLayerValue, SoftmaxCELoss)):
+                node._obj_idx = len(self.objs)
+                self.objs.append(node)
+            else:
+                node._tape_idx = len(self.data)
+                self.data.append(node.data)
+                self.grad.append(0.0)
+        # emit one instruction per non-leaf node, in topological order
+        for node in topo:
+            op = node._opcode
+            if op == OP_LEAF:
+                continue
+            self.ops.append(op)
+            if op == OP_OBJECT:
+                self.out_idx.append(-1)
+                self.in0_idx.append(node._obj_idx)
+                self.in1_idx.append(-1)
+                self.consts.append(0.0)
+            elif op == OP_ITEM:
+                self.out_idx.append(node._tape_idx)
+                self.in0_idx.append(node._prev0._obj_idx)
+                self.in1_idx.append(node.index)
+                self.consts.append(0.0)
+            elif op == OP_REDUCEMAX:
+                self.out_idx.append(node._tape_idx)
+                self.in0_idx.append(len(self.varargs))
+                self.in1_idx.append(len(node._inputs))
+                self.consts.append(0.0)
+                for inp in node._inputs:
+                    self.varargs.append(inp._tape_idx)
+            else:
+                self.out_idx.append(node._tape_idx)
+                self.in0_idx.append(node._prev0._tape_idx)
+                if isinstance(node, BinaryValue):
+                    self.in1_idx.append(node._prev1._tape_idx)
+                else:
+                    self.in1_idx.append(-1)
+                self.consts.append(node.exponent if op == OP_POW else 0.0)
+        # the tape owns the graph structure now; drop the construction-only
+        # child links so the long-lived scalar handles stay small (the object
+        # nodes keep _prev0, their _forward/_backward still follow it)
+        for node in topo:
+            if not isinstance(node, (InputVector, DenseLayerValue, SoftmaxCELoss)):
+                node._release()
+
+    def run_forward(self):
+        data = self.data
+        ops = self.ops
+        out_idx = self.out_idx
+        in0_idx = self.in0_idx
+        in1_idx = self.in1_idx
+        consts = self.consts
+        objs = self.objs
+        for k in range(len(ops)):
+            op = ops[k]
+            out = out_idx[k]
+            a = in0_idx[k]
+            if op == OP_ADD:
+                data[out] = data[a] + data[in1_idx[k]]
+            elif op == OP_SUB:
+                data[out] = data[a] - data[in1_idx[k]]
+            elif op == OP_MUL:
+                data[out] = data[a] * data[in1_idx[k]]
+            elif op == OP_POW:
+                data[out] = data[a] ** consts[k]
+            elif op == OP_EXP:
+                data[out] = math.exp(data[a])
+            elif op == OP_LOG:
+                data[out] = math.log(data[a])
+            elif op == OP_NEG:
+                data[out] = -data[a]
+            elif op == OP_MAX:
+                leftdata = data[a]
+                rightdata = data[in1_idx[k]]
+                data[out] = leftdata if leftdata > rightdata else rightdata
+            elif op == OP_ITEM:
+                data[out] = objs[a].data[in1_idx[k]]
+            elif op == OP_REDUCEMAX:
+                varargs = self.varargs
+                bestdata = data[varargs[a]]
+                for i in range(a + 1, a + in1_idx[k]):
+                    d = data[varargs[i]]
+                    if d > bestdata:
+                        bestdata = d
+                data[out] = bestdata
+            else:
+                assert op == OP_OBJECT
+                objs[a]._forward()
+
+    def run_backward(self):
+        data = self.data
+        grad = self.grad
+        ops = self.back_ops
+        out_idx = self.back_out_idx
+        in0_idx = self.back_in0_idx
+        in1_idx = self.back_in1_idx
+        consts = self.back_consts
+        objs = self.objs
+        for k in range(len(ops)):
+            op = ops[k]
+            a = in0_idx[k]
+            if op == OP_OBJECT:
+                objs[a]._backward()
+                continue
+            g = grad[out_idx[k]]
+            if op == OP_ADD:
+                grad[a] += g
+                grad[in1_idx[k]] += g
+            elif op == OP_SUB:
+                grad[a] += g
+                grad[in1_idx[k]] -= g
+            elif op == OP_MUL:
+                b = in1_idx[k]
+                grad[a] += data[b] * g
+                grad[b] += data[a] * g
+            elif op == OP_POW:
+                exponent = consts[k]
+                grad[a] += exponent * data[a] ** (exponent - 1) * g
+            elif op == OP_EXP:
+                # the forward pass left exp(data[a]) in data[out]
+                grad[a] += data[out_idx[k]] * g
+            elif op == OP_LOG:
+                grad[a] += g / data[a]
+            elif op == OP_NEG:
+                grad[a] -= g
+            elif op == OP_MAX:
+                b = in1_idx[k]
+                if data[a] > data[b]:
+                    grad[a] += g
+                else:
+                    grad[b] += g
+            elif op == OP_REDUCEMAX:
+                varargs = self.varargs
+                best = varargs[a]
+                for i in range(a + 1, a + in1_idx[k]):
+                    if data[varargs[i]] > data[best]:
+                        best = varargs[i]
+                grad[best] += g
+            else:
+                assert op == OP_ITEM
+                objs[a].grad[in1_idx[k]] += g
+
+    def zero_grads(self):
+        self.grad[:] = self._grad_zeros
+        for obj in self.objs:
+            obj._zero_grad()
+
+
+class Mlp:
+    def __init__(self, nin, nouts, batch_size=1):
+        self.batch_size = batch_size
+        self.inp = InputVector(nin, batch_size)
+        sizes = [nin] + nouts
+        self.layers = []
+        prev = self.inp
+        for i in range(len(nouts)):
+            prev = DenseLayerValue(prev, sizes[i], sizes[i+1], nonlin=i != len(nouts)-1)
+            self.layers.append(prev)
+        self.out = prev
+
+    def evalmlp(self):
+        """ scalar views of the output logits (of the first sample) """
+        return [ItemValue(self.out, i) for i in range(self.out.nout)]
+
+    def zero_grads(self):
+        for layer in self.layers:
+            layer.gw[:] = layer._gw_zeros
+            layer.gb[:] = layer._gb_zeros
+
+    def update_params(self, learning_rate):
+        for layer in self.layers:
+            w = layer.w
+            gw = layer.gw
+            for i in range(len(w)):
+                w[i] -= learning_rate * gw[i]
+            b = layer.b
+            gb = layer.gb
+            for i in range(len(b)):
+                b[i] -= learning_rate * gb[i]
+
+    def __repr__(self):
+        return "Mlp of [%s]" % (", ".join(str(layer) for layer in self.layers))
+
+
+class QuantizedMlp:
+    """ an int8 snapshot of the weights, for the end-of-epoch evaluation
+    pass only: each weight row is stored as int8 with a per-row scale, the
+    activations are requantized to eight bits between layers, and the inner
+    dot product is a pure integer multiply-accumulate.  training keeps the
+    float weights, since the grads need the full precision """
+
+    def __init__(self, mlp):
+        self.layers = []
+        for layer in mlp.layers:
+            nin = layer.nin
+            nout = layer.nout
+            w = layer.w
+            wq = array('b', [0] * (nin * nout))
+            scales = array('d', [0.0] * nout)
+            for j in range(nout):
+                base = j * nin
+                biggest = 0.0
+                for i in range(nin):
+                    a = abs(w[base + i])
+                    if a > biggest:
+                        biggest = a
+                scale = biggest / 127.0 if biggest else 1.0
+                scales[j] = scale
+                inv = 1.0 / scale
+                for i in range(nin):
+                    wq[base + i] = int(round(w[base + i] * inv))
+            self.layers.append((wq, scales, layer.b, nin, nout, layer.nonlin))
+
+    def predict(self, image):
+        # the pixels are already eight bit, with an activation scale of
+        # 1/255; every relu output is requantized the same way for the next
+        # layer's integer dot product
+        xq = image.pixels
+        xscale = _INV_255
+        acts = None
+        for wq, scales, b, nin, nout, nonlin in self.layers:
+            acts = [0.0] * nout
+            for j in range(nout):
+                base = j * nin
+                acc = 0
+                for i in range(nin):
+                    acc += wq[base + i] * xq[i]
+                act = b[j] + scales[j] * xscale * acc
+                if nonlin and act < 0.0:
+                    act = 0.0
+                acts[j] = act
+            if nonlin:
+                biggest = max(acts)
+                xscale = biggest / 255.0 if biggest else 1.0
+                inv = 1.0 / xscale
+                xq = array('B', [int(act * inv + 0.5) for act in acts])
+        best = 0
+        for i in range(1, len(acts)):
+            if acts[i] > acts[best]:
+                best = i
+        return best
+
+
+def stable_softmax(output):
+    """ softmax of a list of scalar nodes, shifted by the maximum for
+    numerical stability """
+    max_ = ReduceMaxValue(output)
+    exps = [node.sub(max_).exp() for node in output]
+    total = exps[0]
+    for node in exps[1:]:
+        total = total.add(node)
+    inv_total = total.pow(-1)
+    return [node.mul(inv_total) for node in exps]
+
+
+def loss_of(mlp):
+    """ softmax cross-entropy of the logits against an integer target, fused
+    into one node; the target is set per image on the returned node """
+    return SoftmaxCELoss(mlp.out)
+
+
+def make_main(mlp):
+    """ build the loss graph once, compile it to a tape and return
+    forward/backward/predict functions that re-run it """
+    loss = loss_of(mlp)
+    topo = loss.topo()
+    tape = Tape(topo)
+
+    def forward(batch):
+        """ run the whole minibatch through the net, returning the summed
+        loss; batch must have exactly mlp.batch_size images """
+        inp = mlp.inp.data
+        targets = loss.targets
+        nin = mlp.inp.size
+        base = 0
+        for b in range(len(batch)):
+            im = batch[b]
+            _load_pixels(inp, im.pixels, base, _INV_255)
+            targets[b] = im.label
+            base += nin
+        tape.run_forward()
+        return loss.data
+
+    def backward():
+        # the parameter gradients gw/gb are *not* reset here, they accumulate
+        # until update_params/zero_grads
+        tape.zero_grads()
+        loss.grad = 1.0
+        tape.run_backward()
+
+    def predict(batch):
+        forward(batch)
+        out = mlp.out.data
+        nout = mlp.out.nout
+        result = []
+        base = 0
+        for b in range(len(batch)):
+            best = 0
+            for i in range(1, nout):
+                if out[base + i] > out[base + best]:
+                    best = i
+            result.append(best)
+            base += nout
+        return result
+
+    return forward, backward, predict
+
+
+class image:
+    def __init__(self, label, pixels):
+        self.label = label
+        self.pixels = pixels
+
+
+class images:
+    """ reader for an MNIST idx image/label file pair """
+
+    def __init__(self, images_filename, labels_filename):
+        images_file = open(images_filename, 'rb')
+        labels_file = open(labels_filename, 'rb')
+        magic, num, rows, cols = struct.unpack('>IIII', images_file.read(16))
+        assert magic == 2051
+        assert rows * cols == DIM
+        magic, num_labels = struct.unpack('>II', labels_file.read(8))
+        assert magic == 2049
+        assert num_labels == num
+        self.num = num
+        # map both files once and hand out zero-copy views into the page
+        # cache, instead of two small read()s and a fresh buffer per image
+        self._pixels = memoryview(mmap.mmap(images_file.fileno(), 0,
+                                            access=mmap.ACCESS_READ))
+        self._labels = memoryview(mmap.mmap(labels_file.fileno(), 0,
+                                            access=mmap.ACCESS_READ))
+        images_file.close()
+        labels_file.close()
+        self._next = 0
+
+    def read_image(self):
+        idx = self._next
+        self._next = idx + 1
+        label = self._labels[8 + idx]
+        pixels = self._pixels[16 + idx * DIM: 16 + (idx + 1) * DIM]
+        return image(label, pixels)
+
+    def read_all(self):
+        return [self.read_image() for _ in range(self.num)]
+
+
+def grouper(n, iterable, fillvalue=None):
+    "grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx"
+    # batch by slicing, which is one C-level copy per batch, instead of
+    # appending element by element
+    l = iterable if isinstance(iterable, list) else list(iterable)
+    batches = [l[i:i + n] for i in range(0, len(l), n)]
+    if batches and len(batches[-1]) < n:
+        batches[-1] = batches[-1] + [fillvalue] * (n - len(batches[-1]))
+    return batches
+
+
+def shuffle(l):
+    """ in-place shuffle; with numpy the swap indices come from one bulk
+    C-level permutation call instead of one randbelow call per element """
+    if np is not None:
+        # seeded from the stdlib generator so random.seed still controls
+        # the whole run
+        perm = np.random.default_rng(random.getrandbits(32)).permutation(len(l))
+        l[:] = [l[i] for i in perm]
+    else:
+        random.shuffle(l)
+
+
+def shuffle_and_group(l, batch_size):
+    shuffle(l)
+    # pad the tail with images from the front so every batch is full
+    return grouper(batch_size, l, fillvalue=l[0])
+
+
+def main(argv):
+    random.seed(17)
+    mlp = Mlp(DIM, [50, NUM_DIGITS], BATCH_SIZE)
+    forward, backward, predict = make_main(mlp)
+    training = images('train-images-idx3-ubyte', 'train-labels-idx1-ubyte').read_all()
+    test = images('t10k-images-idx3-ubyte', 't10k-labels-idx1-ubyte').read_all()
+    for epoch in range(NUM_EPOCHS):
+        print("epoch", epoch)
+        batches = shuffle_and_group(training, BATCH_SIZE)
+        for batch_idx, batch in enumerate(batches):
+            mlp.zero_grads()
+            batch_loss = forward(batch)
+            backward()
+            mlp.update_params(LEARNING_RATE / BATCH_SIZE)
+            # logging every batch costs a write syscall plus float
+            # formatting per iteration, so only report now and then
+            if batch_idx % 100 == 0:
+                print("   ", batch_idx, "of", len(batches), "( loss", batch_loss / BATCH_SIZE, ")")
+        # evaluate with the int8 snapshot of the weights
+        qmlp = QuantizedMlp(mlp)
+        correct = 0
+        for im in test:
+            correct += qmlp.predict(im) == im.label
+        print("accuracy", correct / float(len(test)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
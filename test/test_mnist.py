@@ -0,0 +1,213 @@
+import math
+import random
+
+from micrograd.engine import Value
+
+import mnist
+
+
+def test_dense_layer_matches_scalar_graph():
+    # one dense layer node must compute the same forward data and gradients
+    # as the equivalent per-scalar Value graph from micrograd.engine
+    random.seed(42)
+    nin, nout = 4, 3
+    inp = mnist.InputVector(nin)
+    layer = mnist.DenseLayerValue(inp, nin, nout)
+    xs = [random.uniform(-1, 1) for _ in range(nin)]
+    for i in range(nin):
+        inp.data[i] = xs[i]
+    layer._forward()
+
+    xv = [Value(x) for x in xs]
+    outs = []
+    for j in range(nout):
+        act = sum((Value(layer.w[j * nin + i]) * xv[i] for i in range(nin)), Value(layer.b[j]))
+        outs.append(act.relu())
+    for j in range(nout):
+        assert abs(layer.data[j] - outs[j].data) < 1e-12
+
+    # seed the output grads and compare the input gradients
+    loss = sum((out * Value(float(j + 1)) for j, out in enumerate(outs)), Value(0.0))
+    loss.backward()
+    for j in range(nout):
+        layer.grad[j] = float(j + 1)
+    layer._backward()
+    for i in range(nin):
+        assert abs(inp.grad[i] - xv[i].grad) < 1e-12
+
+
+def test_loss_gradients_match_finite_differences():
+    # the full loss graph (dense layers + softmax + nll) checked against
+    # numerical differentiation of the weights
+    random.seed(42)
+    mlp = mnist.Mlp(6, [5, mnist.NUM_DIGITS])
+    forward, backward, predict = mnist.make_main(mlp)
+    im = mnist.image(3, bytes([17, 0, 255, 80, 140, 200][:6]))
+
+    mlp.zero_grads()
+    loss = forward([im])
+    backward()
+    assert loss > 0.0
+
+    layer = mlp.layers[0]
+    eps = 1e-6
+    for idx in [0, 7, 13]:
+        orig = layer.w[idx]
+        layer.w[idx] = orig + eps
+        up = forward([im])
+        layer.w[idx] = orig - eps
+        down = forward([im])
+        layer.w[idx] = orig
+        numeric = (up - down) / (2 * eps)
+        assert abs(layer.gw[idx] - numeric) < 1e-5
+
+
+def _scalar_nll_loss(mlp, target):
+    # the unfused scalar graph for -log(softmax(logits)[target])
+    probs = mnist.stable_softmax(mlp.evalmlp())
+    return probs[target].log().neg()
+
+
+def test_tape_matches_node_interpretation():
+    # running the compiled tape must give the same loss as interpreting the
+    # graph node by node
+    random.seed(42)
+    mlp = mnist.Mlp(6, [5, mnist.NUM_DIGITS])
+    loss = _scalar_nll_loss(mlp, 3)
+    topo = loss.topo()
+    xs = [0.1, 0.0, 1.0, 0.3, 0.55, 0.8]
+    for i in range(6):
+        mlp.inp.data[i] = xs[i]
+    for node in topo:
+        node._forward()
+    expected = loss.data
+    loss.grad = 1.0
+    for node in topo[::-1]:
+        node._backward()
+    expected_grads = list(mlp.inp.grad)
+
+    tape = mnist.Tape(topo)
+    tape.run_forward()
+    assert abs(tape.data[loss._tape_idx] - expected) < 1e-12
+    tape.zero_grads()
+    tape.grad[loss._tape_idx] = 1.0
+    tape.run_backward()
+    for i in range(6):
+        assert abs(mlp.inp.grad[i] - expected_grads[i]) < 1e-12
+
+
+def test_fused_softmax_ce_matches_scalar_graph():
+    # the fused softmax cross-entropy node must agree with the unfused
+    # stable_softmax + log + neg scalar graph, on data and logit grads
+    random.seed(42)
+    mlp = mnist.Mlp(6, [5, mnist.NUM_DIGITS])
+    xs = [0.1, 0.0, 1.0, 0.3, 0.55, 0.8]
+    for i in range(6):
+        mlp.inp.data[i] = xs[i]
+
+    scalar_loss = _scalar_nll_loss(mlp, 3)
+    scalar_topo = scalar_loss.topo()
+    for node in scalar_topo:
+        node._forward()
+    scalar_loss.grad = 1.0
+    for node in scalar_topo[::-1]:
+        node._backward()
+    scalar_grads = list(mlp.out.grad)
+
+    mlp.out._zero_grad()
+    fused = mnist.SoftmaxCELoss(mlp.out)
+    fused.targets[0] = 3
+    fused._forward()
+    fused.grad = 1.0
+    fused._backward()
+
+    assert abs(fused.data - scalar_loss.data) < 1e-12
+    for i in range(mnist.NUM_DIGITS):
+        assert abs(mlp.out.grad[i] - scalar_grads[i]) < 1e-12
+
+
+def test_training_step_reduces_loss():
+    # a few gradient steps on a single image must drive its loss down
+    random.seed(42)
+    mlp = mnist.Mlp(6, [5, mnist.NUM_DIGITS])
+    forward, backward, predict = mnist.make_main(mlp)
+    im = mnist.image(3, bytes([17, 0, 255, 80, 140, 200][:6]))
+    first = forward([im])
+    for _ in range(10):
+        mlp.zero_grads()
+        forward([im])
+        backward()
+        mlp.update_params(0.1)
+    assert forward([im]) < first
+    assert predict([im]) == [3]
+
+
+def test_quantized_mlp_tracks_float_weights():
+    # the int8 snapshot must reconstruct each weight to within half a
+    # quantization step, and agree with the float net on a well-trained image
+    random.seed(42)
+    mlp = mnist.Mlp(6, [5, mnist.NUM_DIGITS])
+    forward, backward, predict = mnist.make_main(mlp)
+    im = mnist.image(3, bytes([17, 0, 255, 80, 140, 200][:6]))
+    for _ in range(20):
+        mlp.zero_grads()
+        forward([im])
+        backward()
+        mlp.update_params(0.1)
+
+    qmlp = mnist.QuantizedMlp(mlp)
+    for layer, (wq, scales, b, nin, nout, nonlin) in zip(mlp.layers, qmlp.layers):
+        for j in range(nout):
+            for i in range(nin):
+                idx = j * nin + i
+                assert abs(wq[idx] * scales[j] - layer.w[idx]) <= scales[j] / 2 + 1e-12
+    assert qmlp.predict(im) == predict([im])[0] == 3
+
+
+def test_training_step_sequence_with_batch():
+    # the real per-batch sequence (zero_grads, forward, backward,
+    # update_params) must work for batch_size > 1; zero_grads used to blow
+    # the nout-length gb array up to nout*batch_size (a BufferError with
+    # the numpy views active)
+    random.seed(42)
+    mlp = mnist.Mlp(6, [5, mnist.NUM_DIGITS], batch_size=3)
+    forward, backward, predict = mnist.make_main(mlp)
+    ims = [mnist.image(d, bytes([(d * 37 + i * 11) % 256 for i in range(6)]))
+           for d in range(3)]
+    first = forward(ims)
+    for _ in range(20):
+        mlp.zero_grads()
+        forward(ims)
+        backward()
+        mlp.update_params(0.1 / 3)
+    for layer in mlp.layers:
+        assert len(layer.gb) == layer.nout
+        assert len(layer.gw) == layer.nin * layer.nout
+    assert forward(ims) < first
+
+
+def test_batched_forward_matches_per_image_runs():
+    # one batched forward/backward must give the summed loss and gradients
+    # of running the images one at a time
+    random.seed(42)
+    ims = [mnist.image(d, bytes([(d * 37 + i * 11) % 256 for i in range(6)]))
+           for d in range(3)]
+
+    random.seed(7)
+    single = mnist.Mlp(6, [5, mnist.NUM_DIGITS])
+    forward1, backward1, _ = mnist.make_main(single)
+    total = 0.0
+    for im in ims:
+        total += forward1([im])
+        backward1()
+    expected_gw = list(single.layers[0].gw)
+
+    random.seed(7)
+    batched = mnist.Mlp(6, [5, mnist.NUM_DIGITS], batch_size=3)
+    forward3, backward3, _ = mnist.make_main(batched)
+    loss = forward3(ims)
+    backward3()
+
+    assert abs(loss - total) < 1e-9
+    for i in range(len(expected_gw)):
+        assert abs(batched.layers[0].gw[i] - expected_gw[i]) < 1e-9